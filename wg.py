@@ -5,10 +5,18 @@ import subprocess
 import platform
 import sys
 import time
-from random import randint, choices
+from random import randint, sample
 import datetime
 import re
 import ipaddress
+import threading
+import socket
+import shlex
+import struct
+import base64
+import codecs
+import binascii
+from urllib.parse import urlsplit, unquote, parse_qs
 
 try:
     from tqdm import tqdm
@@ -28,10 +36,7 @@ class Warp():
         #     self.print("Under Development, comming up in the next version just in few days ...", color = "red")
         #     sys.exit(0)
         self.check_platform()
-        self.download_wgcf()
-        self.download_warpendpoint()
-        self.test_endpoints()
-        self.generate_wiregurd_configs()
+        self.run_stages()
         
         if self.cpu in ["arm64", "armv7"]:
             self.create_detour_configs()
@@ -55,14 +60,24 @@ class Warp():
         self.hiddify_app_settings = "./hiddify_app_settings.json"
         self.ipv4_range_path = "./ipv4_range.txt"
         self.ipv6_range_path = "./ipv6_range.txt"
-        self.shadowsocks_configs_path = "shadowsocks.json"
+        self.shadowsocks_sources = ["https://raw.githubusercontent.com/Jelingam/WarpGenerator/refs/heads/main/utils/shadowsocks.json"]
+        self.shadowsocks_sources_path = "./shadowsocks_sources.txt"   # extra urls or local files, one per line
+        self.shadowsocks_pool_path = "./shadowsocks_pool.jsonl"
+        self.shadowsocks_state_path = "./shadowsocks_state.json"
         self.ip_list_path = "./ip.txt"
+        self.probe_batch_path = "./probe_batch.txt"
+        self.probe_rate_path = "./probe_rate.json"
         self.wgcf_profile_path = "./wgcf-profile.conf"
         self.minimum_config = 2
         self.zero_packet_loss_ips= []
         self.wireguard_configs = []
         self.ip_version4 = True         # alternative 6
+        self.dual_stack = False         # scan ipv4 and ipv6 together
+        self.ipv6_share = 0.5           # share of ipv6 candidates and configs in dual stack mode
+        self.candidate_count = 200
         self.create_detour = False
+        self.public_key = None
+        self.private_key = None
   
     def starting_print_and_inputs(self):
         os.system('cls||clear')
@@ -78,6 +93,7 @@ class Warp():
         self.print("|" + "-"*total_width + "|" , color = table_color)
         self.print(["| ", "[1]", " | ", "Hiddify Warp v > 2", " | ",  "ipV4",  " |"], pad = [2, id_width, 3, text_width, 3, ip_width, 2], color = [table_color, "purple", table_color, "cyan", table_color, "yellow", table_color])
         self.print(["| ", "[2]", " | ", "Hiddify Warp v > 2", " | ",  "ipV6",  " |"], pad = [2, id_width, 3, text_width, 3, ip_width, 2], color = [table_color, "purple", table_color, "cyan", table_color, "yellow", table_color])        
+        self.print(["| ", "[3]", " | ", "Hiddify Warp v > 2", " | ",  "ipV4+6",  " |"], pad = [2, id_width, 3, text_width, 3, ip_width, 2], color = [table_color, "purple", table_color, "cyan", table_color, "yellow", table_color])
         self.print("|" + "-"*total_width + "|" , color = table_color)
         print("\n ")
         ipv = input("Enter your choice: ")
@@ -85,6 +101,15 @@ class Warp():
             self.ip_version4 = True
         elif ipv == "2":
             self.ip_version4 = False
+        elif ipv == "3":
+            self.dual_stack = True
+            share = input(f"share of ipV6 configs in percent (default {int(self.ipv6_share * 100)}): ")
+            if share.strip():
+                try:
+                    self.ipv6_share = min(max(float(share) / 100, 0), 1)
+                except ValueError:
+                    self.print("please enter a number between 0 and 100", color = "red")
+                    sys.exit()
         else:
             self.print("please enter valid choice", color = "red")
             sys.exit()
@@ -93,6 +118,9 @@ class Warp():
         return subprocess.run(command, text=True, shell=True, capture_output=True)
 
     def run_command_print(self, cmd):
+        if isinstance(cmd, list):
+            # with shell=True a list would only run its first item and drop the arguments
+            cmd = shlex.join(cmd)
         with subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=1, universal_newlines=True, shell= True) as p:
             proc = p.communicate()
 
@@ -223,7 +251,8 @@ class Warp():
             self.print("Downloading warpendpoint file ...", color = "cyan")
             warpendpoint_url = f"https://github.com/Jelingam/WarpGenerator/raw/refs/heads/main/utils/warpendpint/{self.cpu}"
             # self.run_command(f'curl -L -o {self.warpendpoint_path} -# --retry 2 "{warpendpoint_url}"')
-            self.download(warpendpoint_url, self.warpendpoint_path)
+            # wgcf may be downloading at the same time, keep the bars on separate lines
+            self.download(warpendpoint_url, self.warpendpoint_path, position = 1)
             self.chmod_file(self.warpendpoint_path)
             if self.check_file_is_executable(self.warpendpoint_path) and self.check_bash_help_is_available(self.warpendpoint_path, "Usage of"):
                 self.print("warpendpoint downloaded successfuly", color = "green")
@@ -271,24 +300,32 @@ class Warp():
                 return False
         return False
 
-    def read_endpoint_result(self):
-        if os.path.isfile(self.warpendpoint_result_path):
+    def read_endpoint_result(self, path: str = ""):
+        path = path or self.warpendpoint_result_path
+        if os.path.isfile(path):
             try:
-                with open(self.warpendpoint_result_path, "rt", encoding='utf-8') as file:
+                with open(path, "rt", encoding='utf-8') as file:
                     reader = csv.reader(file)
-                    self.result = list(reader)
-                    self.result.pop(0)
-                    return True
+                    result = list(reader)
+                    result.pop(0)
+                    return result
             except:
-                return False
-        return False
+                return []
+        return []
+
+    def family_path(self, path: str, ip_version4: bool):
+        # in dual stack mode both families run at once, so each one gets its own files
+        if not self.dual_stack:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}_{'v4' if ip_version4 else 'v6'}{ext}"
 
     def create_new_wgcf_profile(self):
         # self.remove_file(pattern = "wgcf-")
         self.run_command("wgcf register --accept-tos")
         self.run_command("wgcf generate")
     
-    def download(self, url: str, fname: str):
+    def download(self, url: str, fname: str, position: int = 0):
         if os.path.isfile(fname):
             os.remove(fname)
         resp = requests.get(url, stream=True)
@@ -300,6 +337,7 @@ class Warp():
             unit='iB',
             unit_scale=True,
             unit_divisor=1024,
+            position=position,
         ) as bar:
             for data in resp.iter_content(chunk_size=1024):
                 size = file.write(data)
@@ -392,8 +430,10 @@ class Warp():
         url = "https://raw.githubusercontent.com/Jelingam/WarpGenerator/refs/heads/main/utils/ipv4_range.txt"
         self.download(url, self.ipv4_range_path)
 
-    def create_random_ip_list(self, from_ip_range_file: bool = False, count: int = 200):
-        if self.ip_version4:
+    def create_random_ip_list(self, from_ip_range_file: bool = False, count: int = 200, ip_version4: bool = None):
+        ip_version4 = self.ip_version4 if ip_version4 is None else ip_version4
+        ip_list_path = self.family_path(self.ip_list_path, ip_version4)
+        if ip_version4:
             defult_ip_ranges = ["162.159.192.0/255", "162.159.193.0/255", "162.159.195.0/255", "162.159.204.0/255"
                                 "188.114.96.0/255", "188.114.97.0/255", "188.114.98.0/255", "188.114.99.0/255"]
             all_ips = []
@@ -415,7 +455,7 @@ class Warp():
             if len(all_ips) > count:
                 while len(all_ips) != count:
                     all_ips.pop(randint(0, len(all_ips) - 1))
-                with open(self.ip_list_path, "w") as f:
+                with open(ip_list_path, "w") as f:
                     for i, ip in enumerate(all_ips):
                         if i == len(all_ips) - 1:
                             f.write(f"{ip}")
@@ -438,7 +478,7 @@ class Warp():
                         for network in ip_ranges:
                             for i in range(5):
                                 ipv6.append(self.random_ipv6_addr(network.strip()))
-                    with open(self.ip_list_path, "w") as f:
+                    with open(ip_list_path, "w") as f:
                         for i, ip in enumerate(ipv6):
                             if i == len(ipv6) - 1:
                                 f.write(f"[{ip}]")
@@ -456,7 +496,7 @@ class Warp():
                         ipv61 = f"2606:4700:d1::{'%x' % randint(10, 65000)}:{'%x' % randint(10, 65000)}:{'%x' % randint(10, 65000)}:{'%x' % randint(10, 65000)}"
                         ipv6.append(ipv60)
                         ipv6.append(ipv61)
-                        with open(self.ip_list_path, "w") as f:
+                        with open(ip_list_path, "w") as f:
                             for i, ip in enumerate(ipv6):
                                 if i == len(ipv6) - 1:
                                     f.write(f"[{ip}]")
@@ -467,38 +507,301 @@ class Warp():
                     print(e)
                     return False
     
+    def parse_endpoint(self, endpoint: str):
+        # "1.2.3.4:2408" or "[2606:4700:d0::1]:2408"
+        endpoint = endpoint.strip()
+        if endpoint.startswith("["):
+            ip = endpoint.split("[")[1].split("]")[0]
+            port = endpoint.split("]")[1].split(":")[-1]
+        else:
+            ip = endpoint.split(":")[0].strip()
+            port = endpoint.split(":")[1].strip()
+        return ip, port
+
+    def network_id(self, ip_version4: bool = True):
+        # the remembered probe rate belongs to the host and the network it is on
+        if ip_version4:
+            family, target, prefix = socket.AF_INET, ("1.1.1.1", 80), 24
+        else:
+            family, target, prefix = socket.AF_INET6, ("2606:4700:4700::1111", 80), 64
+        try:
+            with socket.socket(family, socket.SOCK_DGRAM) as s:
+                s.connect(target)      # udp connect sends nothing
+                network = ipaddress.ip_network(f"{s.getsockname()[0]}/{prefix}", strict=False)
+        except OSError:
+            network = "offline"
+        if ip_version4 and network != "offline":
+            # behind NAT the /24 is a LAN prefix that many networks share
+            return f"{platform.node()}/{network}/{self.network_tag()}"
+        return f"{platform.node()}/{network}"
+
+    def default_gateway(self):
+        try:
+            with open("/proc/net/route") as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields[1] == "00000000" and int(fields[3], 16) & 2:
+                        return socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+        except (OSError, ValueError, IndexError):
+            pass
+        out = self.run_command("ip route show default").stdout.split()
+        if "via" in out:
+            return out[out.index("via") + 1]
+        return None
+
+    def gateway_mac(self, gateway: str):
+        try:
+            with open("/proc/net/arp") as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields[0] == gateway and fields[3] != "00:00:00:00:00:00":
+                        return fields[3]
+        except (OSError, IndexError):
+            pass
+        return None
+
+    def network_tag(self):
+        # the router's MAC tells networks apart; where android hides it, fall back
+        # to the public address as cloudflare sees it
+        if getattr(self, "_network_tag", None) is None:
+            gateway = self.default_gateway()
+            tag = gateway and self.gateway_mac(gateway)
+            if not tag:
+                try:
+                    trace = requests.get("https://1.1.1.1/cdn-cgi/trace", timeout = 5).text
+                    public_ip = trace.split("ip=")[1].split()[0]
+                    tag = str(ipaddress.ip_network(f"{public_ip}/24", strict=False))
+                except Exception:
+                    tag = gateway or "unknown"
+            self._network_tag = tag
+        return self._network_tag
+
+    def probe_endpoints(self, ips: list, rate: int):
+        ip_version4 = not ips or not ips[0].startswith("[")
+        batch_path = self.family_path(self.probe_batch_path, ip_version4)
+        result_path = self.family_path(self.warpendpoint_result_path, ip_version4)
+        with open(batch_path, "w") as f:
+            f.write("\n".join(ips))
+        if os.path.isfile(result_path):
+            os.remove(result_path)
+        self.run_command_print([self.warpendpoint_path, "-file", batch_path, "-output", result_path, "-max", str(rate)])
+        return self.read_endpoint_result(result_path)
+
+    def control_loss(self, rows: list, control: list):
+        # share of control endpoints that lost packets or didn't answer at all
+        clean = set()
+        for row in rows:
+            if self.zero_packet_loss(row):
+                ip, _ = self.parse_endpoint(row[0])
+                clean.add(ipaddress.ip_address(ip))
+        lost = [c for c in control if ipaddress.ip_address(c.strip("[]")) not in clean]
+        return len(lost) / len(control)
+
+    def probe_pacer(self, families: list):
+        # single stack and dual stack load the link differently, so each remembers its own rate
+        networks = [self.network_id(f == "v4") for f in families]
+        key = "/".join([networks[0]] + [n.split("/", 1)[1] for n in networks[1:]] + ["+".join(families)])
+        return ProbePacer(self.probe_rate_path, key)
+
+    def probe_families(self, batches: dict):
+        # batches: family -> (ips, rate); the families are probed at the same time
+        scheduler = StageScheduler()
+        for f, (ips, rate) in batches.items():
+            if ips:
+                scheduler.add_stage(f, lambda ips = ips, rate = rate: self.probe_endpoints(ips, rate))
+        results = scheduler.run()
+        return {f: results.get(f, []) for f in batches}
+
+    def paced_probe(self, candidates: dict, pacer, shares: dict):
+        # candidates and shares are keyed by family ("v4"/"v6"); each probe rate is one
+        # budget for the whole link, split between the families by their share
+        def split(rate):
+            return {f: max(1, round(rate * shares[f])) for f in candidates}
+
+        def take(sizes, prefix = {}):
+            batches = {}
+            for f in candidates:
+                batches[f] = (prefix.get(f, []) + pending[f][:sizes[f]], rates[f])
+                pending[f] = pending[f][sizes[f]:]
+            return batches
+
+        rows = {f: [] for f in candidates}
+        pending = {f: list(c) for f, c in candidates.items()}
+        if pacer.is_calibrated():
+            self.print(f"using probe rate {pacer.rate} for this network", color = "green")
+            rates = split(pacer.rate)
+            while any(pending.values()):
+                for f, r in self.probe_families(take(rates)).items():
+                    rows[f] += r
+            return rows
+
+        # the scan calibrates itself: batches climb the rate ladder with the control
+        # endpoints mixed in, and the climb stops at the first rate where one of them
+        # loses packets. every batch is part of the real scan, nothing is probed twice
+        # a climb that ran out of candidates last time resumes above its saved rate
+        ladder = [rate for rate in pacer.rates if rate > pacer.rate] if pacer.is_partial() else list(pacer.rates)
+        control = {f: [ip for ip in pacer.control if ip.startswith("[") == (f == "v6")] for f in candidates}
+        best_rate = pacer.rate if pacer.is_partial() else None
+        lost = False
+        step = 0
+        if not any(control.values()):
+            self.print("probing the first batch gently to find a control set ...", color = "cyan")
+            rates = split(ladder[0])
+            for f, r in self.probe_families(take(rates)).items():
+                rows[f] += r
+                control[f] = self.control_from_rows(r)
+            if any(control.values()):
+                best_rate, step = ladder[0], 1
+        else:
+            for f in candidates:
+                pending[f] = [ip for ip in pending[f] if ip not in control[f]]
+        if any(control.values()):
+            self.print(f"calibrating probe rate with {sum(len(c) for c in control.values())} control endpoints ...", color = "cyan")
+        settled = not any(control.values())
+        while any(pending.values()):
+            if settled or step >= len(ladder):
+                rates = split(best_rate or (pacer.rates[0] if lost else ladder[0]))
+                for f, r in self.probe_families(take(rates)).items():
+                    rows[f] += r
+                continue
+            rate = ladder[step]
+            rates = split(rate)
+            sizes = {f: max(rates[f] - len(control[f]), 1) for f in candidates}
+            if any(len(pending[f]) < sizes[f] for f in candidates):
+                # a rung that isn't fully loaded proves nothing, stop climbing here
+                settled = True
+                continue
+            batches = take(sizes, control)
+            results = self.probe_families(batches)
+            loss = max(self.control_loss(results[f], control[f]) for f in candidates if control[f])
+            print(f"rate = {rate}\tcontrol loss = {loss:.0%}")
+            if loss == 0:
+                for f in candidates:
+                    rows[f] += results[f]
+                best_rate, step = rate, step + 1
+                continue
+            # losses in this batch may be self-induced: keep the clean rows and
+            # probe the rest again at the settled rate
+            for f in candidates:
+                clean = [row for row in results[f] if self.zero_packet_loss(row)]
+                rows[f] += clean
+                clean_ips = set(ipaddress.ip_address(self.parse_endpoint(row[0])[0]) for row in clean)
+                batch = batches[f][0][len(control[f]):]
+                pending[f] = [ip for ip in batch if ipaddress.ip_address(ip.strip("[]")) not in clean_ips] + pending[f]
+            settled = lost = True
+
+        all_control = [ip for f in candidates for ip in control[f]]
+        if not all_control or (best_rate is None and lost):
+            # even the slowest rate lost control endpoints, so the control set itself is stale
+            pacer.save(pacer.rates[0], [], calibrated = False)
+        elif best_rate is None:
+            # not enough candidates to test any rung
+            pacer.save(pacer.rates[0], all_control, calibrated = False)
+        else:
+            # only a found ceiling or a fully climbed ladder counts as calibrated,
+            # otherwise the next run keeps climbing from here
+            pacer.save(best_rate, all_control, calibrated = lost or step >= len(ladder))
+        self.print(f"probe rate set to {pacer.rate}", color = "green")
+        return rows
+
+    def control_from_rows(self, rows: list, count: int = 10):
+        clean = []
+        for row in rows:
+            if self.zero_packet_loss(row):
+                ip, _ = self.parse_endpoint(row[0])
+                try:
+                    ping = float(row[-1].strip().split()[0])
+                except (ValueError, IndexError):
+                    continue
+                clean.append((ping, f"[{ip}]" if ":" in ip else ip))
+        return [ip for _, ip in sorted(clean)[:count]]
+
+    def candidate_list(self, ip_version4: bool, count: int):
+        if not self.create_random_ip_list(count = count, ip_version4 = ip_version4):
+            return []
+        with open(self.family_path(self.ip_list_path, ip_version4)) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def endpoints_from_rows(self, rows: list):
+        endpoints = []
+        seen = set()
+        for row in rows:
+            # control endpoints are probed in several batches, keep each endpoint once
+            if self.zero_packet_loss(row) and row[0] not in seen:
+                seen.add(row[0])
+                ip, port = self.parse_endpoint(row[0])
+                ping = row[-1].strip().split()[0]
+                endpoints.append([ip , port, ping])
+        return endpoints
+
+    def scan_families(self, counts: dict, shares: dict):
+        candidates = {f: self.candidate_list(f == "v4", counts[f]) for f in counts}
+        candidates = {f: c for f, c in candidates.items() if c}
+        if not candidates:
+            return {}
+        total = sum(shares[f] for f in candidates)
+        shares = {f: shares[f] / total for f in candidates}
+        pacer = self.probe_pacer(list(candidates))
+        rows = self.paced_probe(candidates, pacer, shares)
+        pacer.update_control([ip for f in candidates for ip in self.control_from_rows(rows[f])])
+        return {f: self.endpoints_from_rows(rows[f]) for f in candidates}
+
+    def scan_endpoints(self, ip_version4: bool, count: int = 200):
+        family = "v4" if ip_version4 else "v6"
+        return self.scan_families({family: count}, {family: 1}).get(family, [])
+
+    def scan_dual_stack(self):
+        v6_count = round(self.candidate_count * self.ipv6_share)
+        counts = {"v4": self.candidate_count - v6_count, "v6": v6_count}
+        shares = {"v4": 1 - self.ipv6_share, "v6": self.ipv6_share}
+        for f in list(counts):
+            if counts[f] > 0 and self.network_id(f == "v4").endswith("/offline"):
+                # no route for this family here, it would only slow the other one down
+                self.print(f"ip{f} is not reachable on this network, scanning without it", color = "yellow")
+                counts[f] = 0
+        counts = {f: c for f, c in counts.items() if c > 0}
+        results = self.scan_families(counts, shares)
+        return self.merge_endpoints(results.get("v4", []), results.get("v6", []))
+
+    def merge_endpoints(self, v4: list, v6: list, count: int = 50):
+        # keep the configured ipv6 share of the best endpoints, and let the other
+        # family fill in when one of them doesn't have enough clean endpoints
+        def ping(row):
+            try:
+                return float(row[2])
+            except ValueError:
+                return float("inf")
+        v4, v6 = sorted(v4, key = ping), sorted(v6, key = ping)
+        total = min(count, len(v4) + len(v6))
+        v6_count = min(round(total * self.ipv6_share), len(v6))
+        v4_count = min(total - v6_count, len(v4))
+        v6_count = min(total - v4_count, len(v6))
+        return sorted(v4[:v4_count] + v6[:v6_count], key = ping)
+
     def test_endpoints(self):
         max_retry = 1
         while max_retry > 0:
-            if self.create_random_ip_list():
-                self.run_command_print([self.warpendpoint_path, "-max",  "200"])
-                if self.read_endpoint_result():
-                    for row in self.result:
-                        if self.zero_packet_loss(row):
-                            if self.ip_version4:
-                                ip = row[0].split(":")[0].strip()
-                                port = row[0].split(":")[1].strip()
-                            else:
-                                ip = row[0].split("[")[1].split("]")[0]
-                                port = row[0].split("]")[1].split(":")[-1]
-                            ping = row[-1].strip().split()[0]
-                            self.zero_packet_loss_ips.append([ip , port, ping])
-                if len(self.zero_packet_loss_ips) >= self.minimum_config:
-                    break
+            if self.dual_stack:
+                self.zero_packet_loss_ips += self.scan_dual_stack()
+            else:
+                self.zero_packet_loss_ips += self.scan_endpoints(self.ip_version4, self.candidate_count)
+            if len(self.zero_packet_loss_ips) >= self.minimum_config:
+                break
             max_retry -= 1
         
         if len(self.zero_packet_loss_ips) < self.minimum_config:
             self.print(f"Sorry! we cant find at least {self.minimum_config} clean IP for you in defined ip range", color = "red")
             self.print(f"consider to turn you VPN off and provide another Cloudflare ip range in 'ip_range.txt file'", color = "red")
             sys.exit(0)
-                
+
+    def print_endpoints_table(self):
         # self.run_command("clear")
         os.system('cls||clear')
         id_width = 4
-        if self.ip_version4:
-            ip_width = 16
-        else:
+        if any(":" in row[0] for row in self.zero_packet_loss_ips):
             ip_width = 36
+        else:
+            ip_width = 16
         port_width = 5
         ping_width = 5
         total_width = id_width + ip_width + port_width + ping_width + 9
@@ -526,7 +829,7 @@ class Warp():
         except:
             return None, None
 
-    def generate_keys_offline(self):
+    def generate_keys_offline(self, interactive: bool = True):
         p = self.wgcf_path.replace("./", "")
         wait_time = 10
         max_retry = 2
@@ -547,7 +850,8 @@ class Warp():
                         self.print("\naccount registerd successfully", color = "green")
                         return
                     time.sleep(1)
-                    print(f"try = {retry + 1} of {max_retry}\tremainimg time = {int(wait_time - (time.time() - start_time))}", end="\r")
+                    if interactive:
+                        print(f"try = {retry + 1} of {max_retry}\tremainimg time = {int(wait_time - (time.time() - start_time))}", end="\r")
                 retry += 1
 
         def create_wgcf_profile():
@@ -567,7 +871,8 @@ class Warp():
                         self.print("\nprofile created successfully", color = "green")
                         return
                     time.sleep(1)
-                    print(f"try = {retry + 1} of {max_retry}\tremainimg time = {int(wait_time - (time.time() - start_time))}", end="\r")
+                    if interactive:
+                        print(f"try = {retry + 1} of {max_retry}\tremainimg time = {int(wait_time - (time.time() - start_time))}", end="\r")
                 retry += 1
 
         try:
@@ -575,6 +880,9 @@ class Warp():
             create_wgcf_account()
             if os.path.isfile("wgcf-account.toml"):
                 create_wgcf_profile()
+            elif not interactive:
+                # asking to build wgcf is left to the caller, once nothing else writes to the console
+                return None, None
             else:
                 print("We can't register an account on Cloudflare; this problem happens because of these two issues:")
                 print("1. Turn on VPN: Please consider this tool can't be run with VPN turned on.")
@@ -616,21 +924,60 @@ class Warp():
         self.chmod_file(self.wgcf_path)
         self.generate_keys_offline()
         
-    def generate_wiregurd_configs(self, online: bool = False, count: int = 50):
-        
+    def run_stages(self):
+        # wgcf account registration doesn't depend on scan results, so it runs
+        # while warpendpoint is scanning; both are joined at config generation
+        scheduler = StageScheduler()
+        scheduler.add_stage("download_wgcf", self.download_wgcf)
+        scheduler.add_stage("download_warpendpoint", self.download_warpendpoint)
+        scheduler.add_stage("generate_keys", lambda: self.generate_keys(interactive = False), depends_on = ["download_wgcf"])
+        scheduler.add_stage("test_endpoints", self.test_endpoints, depends_on = ["download_warpendpoint"])
+        # clearing the screen and asking questions only happen after the join,
+        # so nothing running concurrently can wipe a prompt
+        scheduler.add_stage("generate_configs", self.generate_configs, depends_on = ["generate_keys", "test_endpoints"])
+        scheduler.run()
+        self.print_stage_report(scheduler)
+
+    def generate_configs(self):
+        self.print_endpoints_table()
+        if not self.public_key:
+            self.generate_keys()
+        self.generate_wiregurd_configs()
+
+    def print_stage_report(self, scheduler):
+        name_width = 26
+        time_width = 8
+        table_color = "white"
+        total_width = name_width + time_width * 2 + 6
+        print("\n|-" + "-" * total_width + "-|")
+        self.print(["| ", "Stage", " | ", "Start", " | ", "Time", " |"], pad = [2, name_width, 3, time_width, 3, time_width, 2], color = [table_color, "cyan", table_color, "yellow", table_color, "yellow", table_color])
+        print("|-" + "-" * total_width + "-|")
+        for name, (start, end) in scheduler.timings.items():
+            self.print(["| ", name, " | ", f"{start:.1f}s", " | ", f"{end - start:.1f}s", " |"], pad = [2, name_width, 3, time_width, 3, time_width, 2], color = [table_color, "cyan", table_color, "yellow", table_color, "yellow", table_color])
+        print("|-" + "-" * total_width + "-|")
+        path, path_time = scheduler.critical_path()
+        self.print(f"critical path: {' -> '.join(path)} ({path_time:.1f}s)", color = "purple")
+        self.print(f"wall clock = {scheduler.wall_time():.1f}s, sum of stages = {scheduler.total_stage_time():.1f}s", color = "purple")
+
+    def generate_keys(self, online: bool = False, interactive: bool = True):
         if online:
-            public_key, private_key = self.generate_keys_online()
-            if not public_key:
+            self.public_key, self.private_key = self.generate_keys_online()
+            if not self.public_key:
                 self.print("Generate keys online are not reachable", color = "red")
                 online = False
         
         if not online:
-            public_key, private_key = self.generate_keys_offline()
-            if not public_key:
+            self.public_key, self.private_key = self.generate_keys_offline(interactive)
+            if not self.public_key and interactive:
                 self.print("Can't Generate offline keys with wgcf", color = "red")
                 sys.exit(0)
+        return self.public_key, self.private_key
+
+    def generate_wiregurd_configs(self, online: bool = False, count: int = 50):
         
-        # return public_key, private_key
+        if not self.public_key:
+            self.generate_keys(online)
+        public_key, private_key = self.public_key, self.private_key
         
         for i, row in enumerate(self.zero_packet_loss_ips):
             [ip, port, _] = row
@@ -663,17 +1010,14 @@ class Warp():
             self.create_detour_configs()
         now = datetime.datetime.now().strftime("%Y.%m.%d-%H.%M.%S")
         self.output_detour_path = f"./Wireguard_detours_{now}.txt"
-        self.download("https://raw.githubusercontent.com/Jelingam/WarpGenerator/refs/heads/main/utils/shadowsocks.json", self.shadowsocks_configs_path)
-        with open (self.shadowsocks_configs_path) as file:
-            shadowsocks = json.load(file)
-        l1, l2 = 1000, 1000
-        if count > len(shadowsocks["outbounds"]):
-            l1 = len(shadowsocks["outbounds"])
-        if count > len(self.outbounds["outbounds"]):
-            l2 = len(self.outbounds["outbounds"])
-        count = min(l1, l2, count)
+        shadowsocks = self.ingest_shadowsocks()
+        if not shadowsocks:
+            self.print("no shadowsocks config found in subscription sources", color = "red")
+            return
+        count = max(min(count, len(shadowsocks), len(self.outbounds["outbounds"])), 0)
         self.detour_outbounds = {"outbounds": []}
-        shadowsocks_random_coices = choices(shadowsocks["outbounds"], k = count)
+        shadowsocks_random_coices = [dict(item) for item in sample(shadowsocks, count)]
+        used_tags = set(item["tag"] for item in self.outbounds["outbounds"])
         for i in range(count):
             self.detour_outbounds["outbounds"].append(self.outbounds["outbounds"][i])
             warp_tag = self.outbounds["outbounds"][i]["tag"]
@@ -682,6 +1026,16 @@ class Warp():
                 shadowsocks_random_coices[i]["tag"] = shadowsocks_random_coices[i]["tag"].split()[-3].strip()
             except:
                 pass
+            # tags from different sources can collide, and sing-box rejects duplicate tags
+            tag = shadowsocks_random_coices[i]["tag"]
+            if tag in used_tags:
+                tag = f"{tag} {shadowsocks_random_coices[i]['server']}:{shadowsocks_random_coices[i]['server_port']}"
+            n = 2
+            while tag in used_tags:
+                tag = f"{shadowsocks_random_coices[i]['tag']} {n}"
+                n += 1
+            used_tags.add(tag)
+            shadowsocks_random_coices[i]["tag"] = tag
             self.detour_outbounds["outbounds"].append(shadowsocks_random_coices[i])
 
     
@@ -690,6 +1044,30 @@ class Warp():
             json.dump(self.detour_outbounds, file, indent = 2)
         self.print(f"{count} wireguard configs and {count} shadowsocks detour generated for hiddify in {self.output_detour_path}", color = "cyan")
 
+    def ingest_shadowsocks(self):
+        sources = list(self.shadowsocks_sources)
+        if os.path.isfile(self.shadowsocks_sources_path):
+            with open(self.shadowsocks_sources_path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#") and line not in sources:
+                        sources.append(line)
+        pool = ShadowsocksPool(self.shadowsocks_pool_path, self.shadowsocks_state_path)
+        pool.prune(sources)
+        for source in sources:
+            try:
+                changes = pool.refresh(source)
+            except Exception as e:
+                self.print(f"can't read shadowsocks source {source}: {e}", color = "red")
+                continue
+            if changes is None:
+                print(f"{source} not changed")
+            else:
+                print(f"{changes[0]} new and {changes[1]} removed shadowsocks configs from {source}")
+        pool.save()
+        self.print(f"{len(pool.outbounds)} unique shadowsocks configs in {self.shadowsocks_pool_path}", color = "green")
+        return list(pool.outbounds.values())
+
     def copy_configs_to_device(self):
         storage_access_granted = False
         res = self.run_command("ls /storage/emulated/0/")
@@ -721,6 +1099,389 @@ class Warp():
         # TODO complete this function, create a random option from availabe and user select options
 
 
+class StageScheduler:
+    def __init__(self):
+        self.stages = {}
+        self.results = {}
+        self.errors = {}
+        self.timings = {}
+        self.start_time = None
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+
+    def add_stage(self, name: str, func, depends_on: list = []):
+        for dep in depends_on:
+            if dep not in self.stages:
+                raise ValueError(f"stage {name} depends on unknown stage {dep}")
+        self.stages[name] = (func, list(depends_on))
+
+    def run_stage(self, name: str, done: dict):
+        func, depends_on = self.stages[name]
+        for dep in depends_on:
+            done[dep].wait()
+        try:
+            if any(dep in self.errors for dep in depends_on):
+                return
+            start = time.time() - self.start_time
+            try:
+                result = func()
+            except BaseException as e:
+                # sys.exit() inside a stage must stop the whole run, not only its thread
+                with self.lock:
+                    self.errors[name] = e
+                return
+            with self.lock:
+                self.results[name] = result
+                self.timings[name] = (start, time.time() - self.start_time)
+        finally:
+            done[name].set()
+            with self.lock:
+                self.finished.notify_all()
+
+    def run(self):
+        self.start_time = time.time()
+        done = {name: threading.Event() for name in self.stages}
+        for name in self.stages:
+            threading.Thread(target=self.run_stage, args=(name, done), daemon=True).start()
+        with self.lock:
+            while not self.errors and not all(e.is_set() for e in done.values()):
+                self.finished.wait()
+            if self.errors:
+                raise next(iter(self.errors.values()))
+        return self.results
+
+    def critical_path(self):
+        if not self.timings:
+            return [], 0
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while True:
+            deps = [d for d in self.stages[name][1] if d in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: self.timings[n][1])
+            path.insert(0, name)
+        path_time = sum(self.timings[n][1] - self.timings[n][0] for n in path)
+        return path, path_time
+
+    def wall_time(self):
+        if not self.timings:
+            return 0
+        return max(end for _, end in self.timings.values())
+
+    def total_stage_time(self):
+        return sum(end - start for start, end in self.timings.values())
+
+
+class ProbePacer:
+    lock = threading.Lock()     # pacers may share the state file across threads
+
+    def __init__(self, state_path: str, network: str, rates: list = [25, 50, 100, 200, 400], max_age: int = 24 * 3600):
+        self.state_path = state_path
+        self.network = network
+        self.rates = rates
+        self.max_age = max_age
+        with ProbePacer.lock:
+            self.state = self.read_state()
+        entry = self.state.get(self.network, {})
+        self.rate = entry.get("rate", 200)
+        self.control = entry.get("control", [])
+        self.calibrated_at = entry.get("time", 0)
+
+    def is_calibrated(self):
+        return bool(self.control) and time.time() - self.calibrated_at < self.max_age
+
+    def is_partial(self):
+        # saved by a climb that ran out of candidates before finding the ceiling
+        return bool(self.control) and not self.calibrated_at
+
+    def save(self, rate: int, control: list, calibrated: bool = True):
+        self.rate = rate
+        self.control = control
+        self.calibrated_at = time.time() if calibrated else 0
+        self.write()
+
+    def update_control(self, control: list):
+        # keep the control set fresh with the best endpoints of the latest scan
+        if control:
+            self.control = control
+            self.write()
+
+    def read_state(self):
+        if os.path.isfile(self.state_path):
+            try:
+                with open(self.state_path) as f:
+                    return json.load(f)
+            except ValueError:
+                pass
+        return {}
+
+    def write(self):
+        # re-read under the lock so the other family's entry isn't overwritten
+        with ProbePacer.lock:
+            self.state = self.read_state()
+            self.state[self.network] = {"rate": self.rate, "control": self.control, "time": self.calibrated_at}
+            with open(self.state_path, "w") as f:
+                json.dump(self.state, f, indent = 2)
+
+
+class ShadowsocksPool:
+    def __init__(self, pool_path: str, state_path: str):
+        self.pool_path = pool_path
+        self.state_path = state_path
+        self.outbounds = {}     # server:port:method -> outbound
+        self.sources = {}       # server:port:method -> sources that list this outbound
+        self.state = {}         # source -> etag / last-modified / mtime of the last parsed version
+        if os.path.isfile(self.pool_path):
+            with open(self.pool_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        outbound, sources = entry["outbound"], entry["sources"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    k = self.key(outbound)
+                    self.outbounds.setdefault(k, outbound)
+                    self.sources.setdefault(k, set()).update(sources)
+        # without the pool file, previously seen sources must be parsed again
+        if os.path.isfile(self.pool_path) and os.path.isfile(self.state_path):
+            try:
+                with open(self.state_path) as f:
+                    self.state = json.load(f)
+            except ValueError:
+                self.state = {}
+
+    def key(self, outbound: dict):
+        return f"{outbound.get('server')}:{outbound.get('server_port')}:{outbound.get('method')}"
+
+    def is_valid(self, outbound: dict):
+        if outbound.get("type", "shadowsocks") != "shadowsocks":
+            return False
+        if not outbound.get("server") or not outbound.get("password"):
+            return False
+        if outbound.get("method") in [None, "", "none", "plain"]:
+            return False
+        try:
+            port = int(outbound.get("server_port"))
+        except (TypeError, ValueError):
+            return False
+        if port <= 0 or port > 65535:
+            return False
+        if outbound["server"] in ["localhost"]:
+            return False
+        if outbound.get("plugin") and outbound["plugin"] not in ["obfs-local", "v2ray-plugin"]:
+            return False    # sing-box can't run other plugins
+        try:
+            ip = ipaddress.ip_address(outbound["server"].strip("[]"))
+            if ip.is_loopback or ip.is_unspecified or ip.is_private:
+                return False
+        except ValueError:
+            pass    # domain name
+        return True
+
+    def add(self, outbound: dict, source: str):
+        if not self.is_valid(outbound):
+            return False
+        outbound["server_port"] = int(outbound["server_port"])
+        k = self.key(outbound)
+        self.sources.setdefault(k, set()).add(source)
+        if k in self.outbounds:
+            return False
+        self.outbounds[k] = outbound
+        return True
+
+    def drop_source(self, source: str):
+        # forget what a source listed before; outbounds no other source lists go away
+        removed = 0
+        for k in list(self.sources):
+            self.sources[k].discard(source)
+            if not self.sources[k]:
+                del self.sources[k]
+                del self.outbounds[k]
+                removed += 1
+        return removed
+
+    def prune(self, sources: list):
+        for source in set(s for owners in self.sources.values() for s in owners) - set(sources):
+            self.drop_source(source)
+        for source in list(self.state):
+            if source not in sources:
+                del self.state[source]
+
+    def open_source(self, source: str):
+        # returns (chunks, version) or (None, version) when the source has not changed since last run
+        previous = self.state.get(source)
+        if os.path.isfile(source):
+            stat = os.stat(source)
+            version = {"mtime": stat.st_mtime, "size": stat.st_size}
+            if version == previous:
+                return None, version
+            def read_file():
+                with open(source, encoding="utf-8", errors="ignore") as f:
+                    while chunk := f.read(65536):
+                        yield chunk
+            return read_file(), version
+        headers = {}
+        if previous:
+            if previous.get("etag"):
+                headers["If-None-Match"] = previous["etag"]
+            if previous.get("last_modified"):
+                headers["If-Modified-Since"] = previous["last_modified"]
+        resp = requests.get(source, stream=True, headers=headers, timeout=15)
+        if resp.status_code == 304:
+            return None, previous
+        resp.raise_for_status()
+        version = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+        resp.encoding = resp.encoding or "utf-8"
+        return resp.iter_content(chunk_size=65536, decode_unicode=True), version
+
+    def refresh(self, source: str):
+        # returns (added, removed), or None when the source has not changed
+        chunks, version = self.open_source(source)
+        if chunks is None:
+            return None
+        # parse fully before touching the pool, so a broken download keeps the old entries
+        outbounds = list(self.parse(chunks))
+        before = set(self.outbounds)
+        self.drop_source(source)
+        for outbound in outbounds:
+            self.add(outbound, source)
+        if version and any(version.values()):
+            self.state[source] = version
+        return len(set(self.outbounds) - before), len(before - set(self.outbounds))
+
+    def save(self):
+        # rewrite the whole pool so dropped entries don't pile up in the file
+        tmp_path = f"{self.pool_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for k, outbound in self.outbounds.items():
+                entry = {"sources": sorted(self.sources[k]), "outbound": outbound}
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.pool_path)
+        with open(self.state_path, "w") as f:
+            json.dump(self.state, f, indent = 2)
+
+    def parse(self, chunks):
+        chunks = iter(chunks)
+        head = ""
+        for chunk in chunks:
+            head += chunk
+            if head.strip():
+                break
+        stripped = head.lstrip()
+        rest = self.chain(head, chunks)
+        if stripped.startswith("{") or stripped.startswith("["):
+            yield from self.parse_json(rest)
+        elif "://" in stripped.split("\n")[0]:
+            yield from self.parse_uri_lines(self.lines(rest))
+        else:
+            yield from self.parse_uri_lines(self.lines(self.decode_base64(rest)))
+
+    def chain(self, first: str, chunks):
+        yield first
+        yield from chunks
+
+    def lines(self, chunks):
+        buffer = ""
+        for chunk in chunks:
+            buffer += chunk
+            *complete, buffer = buffer.split("\n")
+            yield from complete
+        if buffer:
+            yield buffer
+
+    def decode_base64(self, chunks):
+        # decode in 4-character aligned blocks so large bodies never sit in memory whole;
+        # one utf-8 decoder for the whole stream keeps characters split across blocks
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        buffer = ""
+        for chunk in chunks:
+            buffer += "".join(chunk.split())
+            cut = len(buffer) - len(buffer) % 4
+            if cut:
+                yield decoder.decode(self.b64decode_bytes(buffer[:cut]))
+                buffer = buffer[cut:]
+        yield decoder.decode(self.b64decode_bytes(buffer.rstrip("=")), final=True)
+
+    def b64decode_bytes(self, text: str):
+        # accepts both the standard and the url-safe (SIP002) alphabet
+        text = text.strip().replace("-", "+").replace("_", "/")
+        try:
+            return base64.b64decode(text + "=" * (-len(text) % 4))
+        except (binascii.Error, ValueError):
+            return b""
+
+    def b64decode(self, text: str):
+        return self.b64decode_bytes(text).decode("utf-8", errors="ignore")
+
+    def parse_json(self, chunks):
+        # pull outbound objects out of '{"outbounds": [ {...}, {...} ]}' one at a time
+        decoder = json.JSONDecoder()
+        buffer = ""
+        in_array = False
+        for chunk in chunks:
+            buffer += chunk
+            if not in_array:
+                match = re.search(r'"outbounds"\s*:\s*\[', buffer) or re.match(r'\s*\[', buffer)
+                if not match:
+                    continue
+                buffer = buffer[match.end():]
+                in_array = True
+            while True:
+                buffer = buffer.lstrip(" \t\r\n,")
+                if not buffer or buffer.startswith("]"):
+                    break
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break   # object not complete yet, wait for the next chunk
+                buffer = buffer[end:]
+                if isinstance(item, dict):
+                    yield item
+
+    def parse_uri_lines(self, lines):
+        for line in lines:
+            outbound = self.parse_uri(line.strip())
+            if outbound:
+                yield outbound
+
+    def parse_uri(self, uri: str):
+        if not uri.startswith("ss://"):
+            return None
+        try:
+            body, _, tag = uri[5:].partition("#")
+            tag = unquote(tag)
+            body, _, query = body.partition("?")
+            body = body.rstrip("/")
+            if "@" not in body:
+                # legacy format: ss://base64(method:password@host:port)
+                body = self.b64decode(body)
+            userinfo, _, hostinfo = body.rpartition("@")
+            if ":" not in unquote(userinfo):
+                userinfo = self.b64decode(userinfo)
+            method, _, password = unquote(userinfo).partition(":")
+            address = urlsplit("//" + hostinfo)
+            outbound = {
+                "type": "shadowsocks",
+                "tag": tag or f"SS {address.hostname}:{address.port}",
+                "server": address.hostname,
+                "server_port": address.port,
+                "method": method,
+                "password": password,
+            }
+            plugin = parse_qs(query).get("plugin")
+            if plugin:
+                # SIP002 "plugin=obfs-local;obfs=http;obfs-host=..." -> sing-box plugin / plugin_opts
+                name, _, opts = plugin[0].partition(";")
+                if name == "simple-obfs":
+                    name = "obfs-local"
+                outbound["plugin"] = name
+                outbound["plugin_opts"] = opts
+            return outbound
+        except ValueError:
+            return None
+
+
 class WireguardConfig:
     def __init__(self, tag: str , ip: str, port: str | int, public_key: str, private_key: str, noise: dict = {}):       
         self.config = {